@@ -5,281 +5,302 @@ api_0_extract_TXT.py
 This script scans a given input folder for ALTO XML files. It can scan
 both the root of the folder and one level of subdirectories.
 
-For each ALTO XML file found, it executes the external command 'alto-tools -s'
-(statistics) to get counts of various XML elements (e.g., <TextLine>,
-<String>, <Illustration>).
-
-It then parses this output and compiles all the statistics into a single
-CSV file, along with the file/page identifiers derived from the filenames
-and the full path to the XML file.
-
-This CSV is the primary input for the next step in the pipeline
-
-Step 2: Extract text from ALTO XML files in parallel.
+For each ALTO XML file found, a worker parses the XML in-process with lxml
+(see `walk_alto`), in parallel and exactly once per page, to get both:
+
+1. Counts of various XML elements (e.g., <TextLine>, <String>,
+   <Illustration>), mirroring the output of `alto-tools -s`. All the
+   statistics are compiled into a single CSV file, along with the
+   file/page identifiers derived from the filenames and the full path
+   to the XML file.
+2. The text of its lines, mirroring `alto-tools -t`, which is
+   de-hyphenated and saved as one .txt file per page - the primary
+   input for the next step in the pipeline.
 """
-import pandas as pd
-import subprocess
 import concurrent.futures
+import csv
+import functools
+import io
 import os
 import sys
+from collections import Counter
 from pathlib import Path
+from lxml import etree
 from tqdm import tqdm
-import re  # For regular expressions, to parse the command output
 
 INPUT_ALTO_DIR = "../ALTO/A-PAGE"
 STATS_CSV = "alto_statistics.csv"
 OUTPUT_TEXT_DIR = "../PAGE_TXT"
 MAX_WORKERS = 16
 
+# Column order of the statistics CSV
+STATS_FIELDS = ["file", "page", "textlines", "illustrations", "graphics", "strings", "path"]
 
-def parse_alto_tools_stats_line(line):
-    """
-    Parses a single line of output from `alto-tools -s`.
+# ALTO elements counted for the statistics CSV, mapped to their column names
+ALTO_STAT_COLUMNS = {
+    "TextLine": "textlines",
+    "String": "strings",
+    "Glyph": "glyphs",
+    "Illustration": "illustrations",
+    "GraphicalElement": "graphics",
+}
+# Namespace-agnostic tag filter for lxml (ALTO v2/v3/v4 use different URIs)
+ALTO_STAT_TAGS = [f"{{*}}{name}" for name in ALTO_STAT_COLUMNS]
 
-    Example input line:
-      "# of <TextLine> elements: 33"
+# Define common hyphen variations found in OCR/Typesetting
+# Standard hyphen, Soft hyphen (\xad), En dash (\u2013), Em dash (\u2014)
+HYPHEN_CHARS = frozenset('-\xad\u2013\u2014')
+
+
+def walk_alto(xml_path):
+    """
+    Parses an ALTO XML file in a single streaming pass with lxml.
 
-    Example output dict:
-      {"textlines": 33}
+    Counts the elements used for page statistics (<TextLine>, <String>,
+    <Glyph>, <Illustration>, <GraphicalElement>) and collects the text of
+    every <TextLine> by joining the @CONTENT of its <String> children,
+    the same way `alto-tools -t` does.
 
     Args:
-        line (str): A single line of text from the command output.
+        xml_path (str): The full path to the ALTO XML file.
 
     Returns:
-        dict or None: A dictionary with a normalized key (e.g., "textlines")
-                      and the integer count, or None if the line doesn't match.
+        tuple[dict, list[str]]: Statistics keyed by CSV column name
+                                (e.g., {"textlines": 33, ...}) and the
+                                text lines of the page in document order.
     """
-    # This regex looks for:
-    #   "# of <" + (one or more word characters) + "> elements:" + (optional whitespace) + (one or more digits)
-    m = re.match(r"# of <(\w+)> elements:\s+(\d+)", line.strip())
-
-    if not m:
-        # Line didn't match the pattern (e.g., it's an empty line)
-        return None
-
-    # m.groups() will be ("TextLine", "33")
-    element, count = m.groups()
-    element = element.lower()  # Normalize to lowercase (e.g., "textline")
-
-    # Map from the XML element name to the desired CSV column name
-    mapping = {
-        "textline": "textlines",
-        "string": "strings",
-        "glyph": "glyphs",
-        "illustration": "illustrations",
-        "graphicalelement": "graphics",
-    }
+    stats = Counter()
+    lines = []
+    words = []
 
-    # Use the mapped name if it exists, otherwise just use the element name
-    key = mapping.get(element, element)
-    return {key: int(count)}
+    # Read the whole page in one call (FileIO sizes the buffer from fstat)
+    # so the many pages in flight on the worker pool each cost a single
+    # read() instead of a series of small chunked reads by the parser.
+    with open(xml_path, "rb") as f:
+        data = f.read()
 
+    for _, elem in etree.iterparse(io.BytesIO(data), events=("end",), tag=ALTO_STAT_TAGS):
+        # Strip the namespace, e.g. "{http://...ns-v4#}String" -> "String"
+        name = elem.tag.rpartition("}")[2]
+        stats[ALTO_STAT_COLUMNS[name]] += 1
 
-def run_alto_tools_stats(xml_path):
-    """
-    Runs the `alto-tools -s` command on a single XML file and parses its output.
+        if name == "String":
+            words.append(elem.get("CONTENT", ""))
+        elif name == "TextLine":
+            lines.append(" ".join(words).strip())
+            words = []
 
-    Args:
-        xml_path (str): The full path to the ALTO XML file.
+        # Children were already consumed, free them to keep memory flat
+        elem.clear()
 
-    Returns:
-        dict or None: A dictionary containing all statistics for the file,
-                      or None if the command fails.
-    """
-    cmd = ["alto-tools", "-s", xml_path]
-    try:
-        # Run the command and capture its standard output
-        # 'stderr=subprocess.STDOUT' merges error messages into the output
-        # 'text=True' decodes the output as text (not bytes)
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT, text=True)
-    except subprocess.CalledProcessError as e:
-        # The command failed (returned a non-zero exit code)
-        print(f"⚠️ Error running alto-tools on {xml_path}: {e.output}")
-        return None
-
-    stats = {}
-    # Process the command's output line by line
-    for line in out.splitlines():
-        parsed = parse_alto_tools_stats_line(line)
-        if parsed:
-            # Add the parsed {key: value} to our main stats dictionary
-            stats.update(parsed)
-    return stats
-
-
-def process_alto_files_with_alto_tools(directory_path):
+    return dict(stats), lines
+
+
+def find_alto_files(directory_path):
     """
-    Processes all ALTO XML files found directly within a given directory.
+    Lists all ALTO XML files found directly within a given directory.
 
     Args:
         directory_path (str): The folder to scan for .xml files.
 
     Returns:
-        list[dict]: A list of dictionaries, where each dict holds the
-                    stats for one file.
+        list[tuple]: (file_id, page, xml_path) for every file, with the
+                     file and page IDs derived from the filename.
     """
     results = []
     # Loop through every file in the directory
-    for fname in os.listdir(directory_path):
+    for entry in os.scandir(directory_path):
+        fname = entry.name
         # Skip files that don't end in .xml
         if not fname.lower().endswith(".xml"):
             continue
 
-        xml_path = os.path.join(directory_path, fname)
-
-        # Get the statistics for this file
-        stats = run_alto_tools_stats(xml_path)
-        if stats is None:
-            # An error occurred and was already printed, so just skip this file
-            continue
-
         # --- Derive file ID and page ID from the filename ---
         # e.g., "doc123-001.alto.xml"
-        base = os.path.basename(fname).split(".")[0]  # "doc123-001"
+        base = fname.split(".")[0]  # "doc123-001"
         parts = base.split("-")  # ["doc123", "001"]
         file_id = parts[0]  # "doc123"
         page = parts[1] if len(parts) > 1 else ""  # "001"
 
-        # Build the result dictionary for this file
-        rec = {
-            "file": file_id,
-            "page": page,
-        }
-
-        # Map the parsed keys to our final dictionary keys, defaulting to 0
-        rec["textlines"] = int(stats.get("textlines", 0))
-        rec["illustrations"] = int(stats.get("illustrations", 0))
-        rec["graphics"] = int(stats.get("graphics", 0))
-        rec["strings"] = int(stats.get("strings", 0))
-        # Add the full path, as this is needed by later scripts
-        rec["path"] = xml_path
-
-        results.append(rec)
+        results.append((file_id, page, entry.path))
     return results
 
 
-def extract_single_page(args):
-    """Worker function to extract one page with robust de-hyphenation."""
-    file_id, page_id, xml_path, output_dir = args
+def build_stats_record(file_id, page, xml_path, stats):
+    """
+    Builds the statistics CSV row of one page.
 
-    # Define output path
-    save_dir = Path(output_dir) / str(file_id)
-    save_dir.mkdir(parents=True, exist_ok=True)
-    txt_path = save_dir / f"{file_id}-{page_id}.txt"
+    Args:
+        file_id (str): Document identifier (e.g., "doc123").
+        page (str): Page identifier (e.g., "001").
+        xml_path (str): The full path to the ALTO XML file.
+        stats (dict): Element counts as returned by `walk_alto`.
 
-    # Skip if exists
-    if txt_path.exists():
-        return True
+    Returns:
+        dict: The row, keyed by the STATS_FIELDS column names.
+    """
+    # Build the result dictionary for this file
+    rec = {
+        "file": file_id,
+        "page": page,
+    }
 
-    # Define common hyphen variations found in OCR/Typesetting
-    # Standard hyphen, Soft hyphen (\xad), En dash (\u2013), Em dash (\u2014)
-    HYPHEN_VARIATIONS = ('-', '\xad', '\u2013', '\u2014')
+    # Map the parsed keys to our final dictionary keys, defaulting to 0
+    rec["textlines"] = int(stats.get("textlines", 0))
+    rec["illustrations"] = int(stats.get("illustrations", 0))
+    rec["graphics"] = int(stats.get("graphics", 0))
+    rec["strings"] = int(stats.get("strings", 0))
+    # Add the full path, as this is needed by later scripts
+    rec["path"] = xml_path
+    return rec
 
-    # Run extraction (alto-tools)
-    cmd = ["alto-tools", "-t", xml_path]
-    backup_xml_path = Path(xml_path).parents[1] / "onepagers" / Path(xml_path).name
-    if backup_xml_path.exists():
-        cmd = ["alto-tools", "-t", str(backup_xml_path)]
 
-    try:
-        res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8')
-        if res.returncode == 0:
-            lines = [l.strip() for l in res.stdout.splitlines() if l.strip()]
+def dehyphenate(lines):
+    """
+    Joins words hyphenated across line breaks in a single forward pass.
 
-            # De-hyphenation Logic
-            for i in range(len(lines) - 1):
-                # Check if line ends with any of the hyphen variations
-                if lines[i].endswith(HYPHEN_VARIATIONS):
+    When a line ends with any of the hyphen variations, the hyphen is
+    dropped and the first word of the next line is appended to it; the
+    rest of that next line carries on (and may itself end in a hyphen).
+    Lines consumed entirely by a merge are not emitted.
 
-                    # Remove the specific hyphen character detected
-                    # We strip the last character regardless of which variation it was
-                    prefix = lines[i][:-1]
+    Args:
+        lines (list[str]): Stripped, non-empty text lines of a page.
+
+    Returns:
+        list[str]: The de-hyphenated lines.
+    """
+    out = []
+    it = iter(lines)
+    cur = next(it, None)
+
+    for nxt in it:
+        # Check if line ends with any of the hyphen variations
+        if cur and cur[-1] in HYPHEN_CHARS:
+            next_line_parts = nxt.split(None, 1)
+            if next_line_parts:
+                # Remove the hyphen and combine with the suffix from the next line
+                out.append(cur[:-1] + next_line_parts[0])
+                # Remainder of the next line (possibly nothing) becomes current
+                cur = next_line_parts[1] if len(next_line_parts) > 1 else ""
+                continue
+
+        if cur:
+            out.append(cur)
+        cur = nxt
+
+    if cur:
+        out.append(cur)
+    return out
+
+
+@functools.lru_cache(maxsize=4096)
+def ensure_output_dir(output_dir, file_id):
+    """Creates the output folder of a document once and returns its Path."""
+    save_dir = Path(output_dir) / str(file_id)
+    save_dir.mkdir(parents=True, exist_ok=True)
+    return save_dir
 
-                    next_line_parts = lines[i + 1].split(maxsplit=1)
 
-                    if next_line_parts:
-                        suffix = next_line_parts[0]
+def process_single_page(args):
+    """
+    Worker function handling one page end to end: the ALTO XML is parsed
+    once, yielding both its statistics row and its text, which is written
+    out with robust de-hyphenation.
 
-                        # Combine prefix and suffix on the current line
-                        lines[i] = prefix + suffix
+    Returns:
+        tuple[dict or None, bool]: The statistics row (None if the XML
+                                   cannot be parsed) and whether the text
+                                   file is in place.
+    """
+    file_id, page, xml_path, backup_xml_path, output_dir = args
 
-                        # Remove the suffix from the next line
-                        if len(next_line_parts) > 1:
-                            lines[i + 1] = next_line_parts[1]
-                        else:
-                            lines[i + 1] = ""
+    try:
+        stats, lines = walk_alto(xml_path)
+    except (OSError, etree.XMLSyntaxError) as e:
+        print(f"⚠️ Error parsing {xml_path}: {e}")
+        return None, False
+    rec = build_stats_record(file_id, page, xml_path, stats)
+
+    # Numeric page IDs are written without leading zeros
+    # (e.g., "001" -> "doc123-1.txt")
+    page_id = int(page) if page.isdigit() else page
+
+    # Define output path (pages of one document share the folder)
+    save_dir = ensure_output_dir(output_dir, file_id)
+    txt_path = save_dir / f"{file_id}-{page_id}.txt"
 
-            # Final cleanup: Remove any empty lines created by the merge
-            final_lines = [l for l in lines if l.strip()]
+    # Skip if exists
+    if txt_path.exists():
+        return rec, True
 
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write("\n".join(final_lines))
-            return True
-        else:
-            return False
+    try:
+        # Prefer the one-page backup copy of the ALTO if there is one;
+        # only then does the page need a second parse
+        if backup_xml_path != xml_path and os.path.exists(backup_xml_path):
+            _, lines = walk_alto(backup_xml_path)
+        # Drop empty <TextLine>s
+        lines = [l for l in lines if l]
+
+        # De-hyphenation Logic
+        final_lines = dehyphenate(lines)
+
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(final_lines))
+        return rec, True
     except Exception:
-        return False
+        return rec, False
 
 
 def main():
-    # --- 2. Prepare Output File ---
-    # Remove the output file if it already exists, so we start fresh
-    if os.path.exists(STATS_CSV):
-        os.remove(STATS_CSV)
-
-    # --- 3. Find Subdirectories ---
+    # --- 2. Find Subdirectories ---
     # This script is designed to check the root input_folder *and*
     # one level of subdirectories.
-    subdirs = [os.path.join(INPUT_ALTO_DIR, d)
-               for d in os.listdir(INPUT_ALTO_DIR)
-               if os.path.isdir(os.path.join(INPUT_ALTO_DIR, d))]
-
-    # 'first' flag is used to ensure we only write the CSV header *once*
-    first = True
-
-    # --- 4. Process Subdirectories ---
-    for subdir in subdirs:
-        stats = process_alto_files_with_alto_tools(subdir)
-        if stats:
-            # Convert the list of dictionaries into a pandas DataFrame
-            df = pd.DataFrame(stats)
-            if first:
-                # First write: include the header
-                df.to_csv(STATS_CSV, index=False, header=True)
-                first = False
-            else:
-                # Subsequent writes: append (mode="a") and skip the header
-                df.to_csv(STATS_CSV, index=False, header=False, mode="a")
-            print(f"Processed {len(stats)} files from {subdir}")
-
-    # --- 5. Process Root Directory ---
-    # After processing subdirs, process any .xml files in the root folder
-    stats = process_alto_files_with_alto_tools(INPUT_ALTO_DIR)
-    if stats:
-        df = pd.DataFrame(stats)
-        if first:
-            df.to_csv(STATS_CSV, index=False, header=True)
-            first = False
-        else:
-            df.to_csv(STATS_CSV, index=False, header=False, mode="a")
-        print(f"Processed {len(stats)} files from {INPUT_ALTO_DIR}")
-
-    print("Done.")
-
-    df = pd.read_csv(STATS_CSV)
-    print(f"Loaded {len(df)} pages to extract.")
+    # DirEntry caches the file type from the directory read, so no extra stat()
+    subdirs = [e.path for e in os.scandir(INPUT_ALTO_DIR) if e.is_dir()]
 
+    # --- 3. Collect Pages ---
     tasks = []
-    for _, row in df.iterrows():
-        tasks.append((row['file'], row['page'], row['path'], OUTPUT_TEXT_DIR))
+    # Subdirectories first, then any .xml files in the root folder
+    for directory in subdirs + [INPUT_ALTO_DIR]:
+        pages = find_alto_files(directory)
+        if not pages:
+            continue
+
+        # One-page backup copies live next to the document folders,
+        # e.g. "A-PAGE/onepagers/<file>" for "A-PAGE/<doc>/<file>"
+        backup_dir = os.path.join(os.path.dirname(os.path.normpath(directory)), "onepagers")
 
-    # Parallel Execution
-    print(f"Extracting with {MAX_WORKERS} workers...")
-    with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        results = list(tqdm(executor.map(extract_single_page, tasks), total=len(tasks)))
+        for file_id, page, xml_path in pages:
+            backup_xml_path = os.path.join(backup_dir, os.path.basename(xml_path))
+            tasks.append((file_id, page, xml_path, backup_xml_path, OUTPUT_TEXT_DIR))
+        print(f"Found {len(pages)} files in {directory}")
 
+    print(f"Loaded {len(tasks)} pages to process.")
+
+    # --- 4. Parallel Execution ---
+    # Each worker reads its XML once for both the stats and the text.
+    # Threads are enough here: lxml releases the GIL while parsing, and
+    # they avoid pickling every task and result across processes.
+    n_workers = MAX_WORKERS * 2
+    print(f"Processing with {n_workers} workers...")
+
+    results = []
+    # Opening with "w" replaces any previous run, so we start fresh
+    with open(STATS_CSV, "w", newline="", encoding="utf-8") as f, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=STATS_FIELDS, lineterminator="\n")
+        writer.writeheader()
+
+        # map() yields in task order, so rows keep the directory order
+        for rec, ok in tqdm(executor.map(process_single_page, tasks), total=len(tasks)):
+            if rec is not None:
+                writer.writerow(rec)
+            results.append(ok)
+
+    print(f"Stats saved to {STATS_CSV}")
     print(f"Extraction complete. Success rate: {sum(results) / len(results):.2%}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
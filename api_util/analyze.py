@@ -3,190 +3,163 @@ import re
 import sys
 import os
 import csv
+import functools
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from cnec_types import parse_tag_and_type
 
 # Increase field limit for large CSVs
 csv.field_size_limit(sys.maxsize)
 
-# --- CNEC 2.0 Type Hierarchy Mapping ---
-# Based on: https://ufal.mff.cuni.cz/~strakova/cnec2.0/ne-type-hierarchy.pdf
-CNEC_TYPE_MAP = {
-    # a: Numbers, addresses, time
-    "a": "Address/Number/Time (General)",
-    "A": "Complex Address/Number/Time",
-    "ah": "Street address",
-    "at": "Phone/Fax number",
-    "az": "Zip code",
-
-    # g: Geographical names
-    "g": "Geographical name (General)",
-    "G": "Geographical name (General)",
-    "g_": "Geographical name (General)",
-    "gu": "Settlement name (City/Town)",
-    "gl": "Nature/Landscape name (Mountain/River)",
-    "gq": "Urban geographical name (Street/Square)",
-    "gr": "Territorial name (State/Region)",
-    "gs": "Super-terrestrial name (Star/Planet)",
-    "gc": "States/Provinces/Regions",
-    "gt": "Continents",
-    "gh": "Hydronym (Bodies of water)",
-
-    # i: Institutions
-    "i": "Institution name (General)",
-    "i_": "Institution name (General)",
-    "I": "Institution name (General)",
-    "ia": "Conference/Contest",
-    "if": "Company/Firm",
-    "io": "Organization/Society",
-    "ic": "Cult/Educational institution",
-
-    # m: Media names
-    "m": "Media name (General)",
-    "mn": "Periodical name (Newspaper/Magazine)",
-    "ms": "Radio/TV station",
-    "mi": "Internet links",
-
-    # o: Artifact names
-    "o": "Artifact name (General)",
-    "o_": "Artifact name (General)",
-    "oa": "Cultural artifact (Book/Painting)",
-    "oe": "Measure unit",
-    "om": "Currency",
-    "or": "Directives, norms",
-    "op": "Product (General)",
-
-    # p: Personal names
-    "p": "Personal name (General)",
-    "p_": "Personal name (General)",
-    "P": "Complex personal names",
-    "pf": "First name",
-    "ps": "Surname",
-    "pm": "Second name",
-    "ph": "Nickname/Pseudonym",
-    "pc": "Inhabitant name",
-    "pd": "Academic titles",
-    "pp": "Relig./myth persons",
-    "me": "Email address",
-
-    # t: Time expressions
-    "t": "Time expression (General)",
-    "T": "Complex time expressions",
-    "td": "Day",
-    "th": "Hour",
-    "tm": "Month",
-    "ty": "Year",
-    "tf": "Holiday/Feast",
-    "tt": "Time block",
-
-    # n: Number expressions
-    "n": "Number expression (General)",
-    "N": "Complex number expressions",
-    "n_": "Number expression (General)",
-    "na": "Age",
-    "nb": "Volu-metric number",
-    "nc": "Cardinal number",
-    "ni": "Itemizer (1.)",
-    "no": "Ordinal number",
-    "ns": "Sport score",
-
-    # General / Fallback
-    "unk": "Unknown Type",
-    "O": "None",
-    "C": "Complex bibliographic expression",
-}
-
-
-def parse_tag_and_type_tsv(raw_tag):
+# Page number suffix of per-page NameTag files, e.g. "docname-1.tsv"
+_PAGE_RE = re.compile(r'-(\d+)\.tsv$')
+
+# Token and tag columns of a NameTag TSV row ("Word\tTag\tNE"); the tag
+# stops before any '\r' so CRLF files parse the same, and rows with an empty
+# tag ("word\t\t", as nametag.py writes them) do not match and are skipped
+_TSV_ROW_RE = re.compile(r'^([^\t\n]+)\t([^\t\r\n]+)', re.M)
+
+# BIO state by the first character of a parsed tag ("O", "B-...", "I-...")
+_OUTSIDE, _BEGIN, _INSIDE = 0, 1, 2
+_BIO_STATE = {"O": _OUTSIDE, "B": _BEGIN, "I": _INSIDE}
+
+# I/O buffering for the NameTag TSVs and the stats CSV
+READ_BUFFER_SIZE = 1 << 20  # 1 MiB
+WRITE_BUFFER_SIZE = 1 << 23  # 8 MiB
+ROW_BATCH_SIZE = 256
+
+# Pages handed to a worker process at a time
+TASK_CHUNK_SIZE = 64
+
+
+def read_tsv_columns(tsv_path):
     """
-    Parses a raw BIO tag (e.g., "B-p", "I-p", "O").
-    Returns (BIO_Tag, Full_Type_Name).
+    Reads a NameTag TSV file (Header + Word\tTag\tNE) in one go.
+    Returns two parallel lists: (tokens, raw_tags).
     """
-    if raw_tag == "O" or not raw_tag:
-        return "O", None
+    # One large buffered binary read, decoded once for the whole file
+    with open(tsv_path, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        data = f.read().decode('utf-8')
+
+    first_line, _, body = data.partition('\n')
 
-    # Handle B-type / I-type
-    if raw_tag.startswith("B-") or raw_tag.startswith("I-"):
-        # Strip prefix to get the short code (e.g., "p" from "B-p")
-        # Handle cases like "B-P|B-pf" by taking the first one
-        primary = raw_tag.split('|')[0]
-        prefix = primary[:2]  # B- or I-
-        short_code = primary[2:]
+    # If the file is empty or just header
+    if not first_line.strip():
+        return [], []
 
-        full_type_name = CNEC_TYPE_MAP.get(short_code, f"Unknown Code ({short_code})")
-        return primary, full_type_name
+    # Skip header if present (unlikely to be missing given nametag.py, but safe)
+    if not first_line.strip().startswith("Word"):
+        body = data
 
-    return "O", None
+    # One C-level regex pass over the whole body picks (token, tag) from
+    # every row; rows without a tag column do not match
+    rows = _TSV_ROW_RE.findall(body)
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+
+@functools.lru_cache(maxsize=1024)
+def tag_state(raw_tag):
+    """
+    Resolves a raw NameTag tag to (BIO state code, Entity_Full_Type_Name).
+    Cached, so each distinct tag is parsed and classified only once.
+    """
+    bio_tag, full_etype = parse_tag_and_type(raw_tag)
+    return _BIO_STATE[bio_tag[0]], full_etype
+
+
+def _entity_text(tokens, start, end):
+    """Joins tokens[start:end]; most entities are a single token and need no join."""
+    return tokens[start] if end - start == 1 else " ".join(tokens[start:end])
 
 
 def get_entities_from_tsv(tsv_path):
     """
     Parses a NameTag TSV file (Header + Word\tTag\tNE).
-    Returns a list of (Entity_Text, Entity_Full_Type_Name).
+    Yields (Entity_Text, Entity_Full_Type_Name) for every entity found.
     """
-    entities = []
-    curr_toks = []
-    curr_type = None
-
     try:
-        with open(tsv_path, 'r', encoding='utf-8') as f:
-            # Skip header if present
-            first_line = next(f, "").strip()
-            # If the file is empty or just header
-            if not first_line: return []
-
-            # Reset pointer if it wasn't a header (unlikely given nametag.py, but safe)
-            if not first_line.startswith("Word"):
-                f.seek(0)
-
-            for line in f:
-                line = line.strip()
-                if not line: continue
-
-                parts = line.split('\t')
-                if len(parts) < 2: continue
-
-                tok = parts[0]
-                tag_raw = parts[1]  # "B-per"
-
-                # Use our parser
-                bio_tag, full_etype = parse_tag_and_type_tsv(tag_raw)
-
-                # --- BIO LOGIC ---
-                if bio_tag.startswith('B') or (bio_tag != 'O' and not curr_toks):
-                    # Close previous
-                    if curr_toks:
-                        entities.append((" ".join(curr_toks), curr_type))
-                    # Start new
-                    curr_toks = [tok]
-                    curr_type = full_etype
-
-                elif bio_tag.startswith('I') and curr_toks:
-                    curr_toks.append(tok)
-
-                else:  # O
-                    if curr_toks:
-                        entities.append((" ".join(curr_toks), curr_type))
-                        curr_toks = []
-                        curr_type = None
-
-            # Flush end
-            if curr_toks:
-                entities.append((" ".join(curr_toks), curr_type))
-
+        tokens, raw_tags = read_tsv_columns(tsv_path)
     except Exception as e:
         print(f"[Error] parsing {os.path.basename(tsv_path)}: {e}", file=sys.stderr)
+        return
+
+    # Open entity as the index of its first token; it is emitted
+    # as soon as the span over the flat token list closes
+    curr_start = None
+    curr_type = None
 
-    return entities
+    for i, raw_tag in enumerate(raw_tags):
+        # Fast path: plain "O" is most tokens and needs no parsing
+        if raw_tag == "O":
+            if curr_start is not None:
+                yield _entity_text(tokens, curr_start, i), curr_type
+                curr_start = None
+                curr_type = None
+            continue
+
+        # Use our parser; the cached tag_state turns the raw tag
+        # into an integer state code
+        state, full_etype = tag_state(raw_tag)
+
+        # --- BIO LOGIC ---
+        if state == _INSIDE and curr_start is not None:
+            # Continuation just extends the open span
+            continue
+
+        elif state:  # B, or an I without an open entity
+            # Close previous
+            if curr_start is not None:
+                yield _entity_text(tokens, curr_start, i), curr_type
+            # Start new
+            curr_start = i
+            curr_type = full_etype
+
+        else:  # O
+            if curr_start is not None:
+                yield _entity_text(tokens, curr_start, i), curr_type
+                curr_start = None
+                curr_type = None
+
+    # Flush end
+    if curr_start is not None:
+        yield _entity_text(tokens, curr_start, len(tokens)), curr_type
 
 
 def extract_page_number(filename):
     """Extracts '1' from 'docname-1.tsv'."""
-    match = re.search(r'-(\d+)\.tsv$', filename)
+    match = _PAGE_RE.search(filename)
     if match:
         return int(match.group(1))
     return 0
 
 
+def page_stats_row(task):
+    """
+    Worker function building the stats row of one page.
+    task is (doc_name, tsv_path, page_num, top_n); returns the row, or
+    None if the page has no entities.
+    """
+    doc_name, tsv_path, page_num, top_n = task
+
+    # Count unique (Text, Type) pairs of this specific page,
+    # straight from the entity stream
+    c = Counter(get_entities_from_tsv(tsv_path)).most_common(top_n)
+
+    if not c:
+        return None
+
+    row = [doc_name, page_num]
+    for (ne_text, ne_type), cnt in c:
+        row.extend([ne_text, ne_type, cnt])
+
+    # Padding
+    missing = top_n - len(c)
+    if missing > 0:
+        row.extend(["", "", 0] * missing)
+    return row
+
+
 def main():
     if len(sys.argv) < 3:
         print("Usage: analyze.py <input_ne_root_dir> <stats_file>")
@@ -199,7 +172,8 @@ def main():
     os.makedirs(os.path.dirname(stats_file), exist_ok=True)
     print(f"[Stats] Scanning entities in: {input_root_dir}")
 
-    with open(stats_file, 'w', newline='', encoding='utf-8-sig') as f:
+    # Large write buffer: one small row per page would otherwise mean many small writes
+    with open(stats_file, 'w', newline='', encoding='utf-8-sig', buffering=WRITE_BUFFER_SIZE) as f:
         w = csv.writer(f)
         header = ["file", "page"] + [x for i in range(1, top_n + 1) for x in (f"ne{i}", f"type{i}", f"cnt-{i}")]
         w.writerow(header)
@@ -207,15 +181,16 @@ def main():
         # Iterate over document directories in NE/
         if os.path.exists(input_root_dir):
             # Get list of subdirectories
-            doc_dirs = sorted([d for d in os.listdir(input_root_dir) if os.path.isdir(os.path.join(input_root_dir, d))])
+            doc_dirs = sorted(e.name for e in os.scandir(input_root_dir) if e.is_dir())
 
             count_processed = 0
+            tasks = []
 
             for doc_name in doc_dirs:
                 doc_path = os.path.join(input_root_dir, doc_name)
 
                 # Find all TSV files for this document
-                tsv_files = sorted([f for f in os.listdir(doc_path) if f.endswith(".tsv")])
+                tsv_files = sorted(e.name for e in os.scandir(doc_path) if e.name.endswith(".tsv"))
 
                 if not tsv_files:
                     continue
@@ -223,28 +198,27 @@ def main():
                 for tsv_file in tsv_files:
                     full_path = os.path.join(doc_path, tsv_file)
                     page_num = extract_page_number(tsv_file)
+                    tasks.append((doc_name, full_path, page_num, top_n))
 
-                    # Extract entities for this specific page
-                    entities = get_entities_from_tsv(full_path)
+                count_processed += 1
 
-                    if not entities:
+            # Pages are independent, so they are counted on all cores;
+            # map() keeps the rows in page order. No more workers are
+            # started than there are chunks of pages to hand out.
+            n_workers = max(1, min(os.cpu_count() or 1, -(-len(tasks) // TASK_CHUNK_SIZE)))
+            pending_rows = []
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                for row in executor.map(page_stats_row, tasks, chunksize=TASK_CHUNK_SIZE):
+                    if row is None:
                         continue
 
-                    # Count unique (Text, Type) pairs
-                    c = Counter(entities).most_common(top_n)
+                    # Rows are handed to the writer in batches
+                    pending_rows.append(row)
+                    if len(pending_rows) >= ROW_BATCH_SIZE:
+                        w.writerows(pending_rows)
+                        pending_rows.clear()
 
-                    row = [doc_name, page_num]
-                    for (ne_text, ne_type), cnt in c:
-                        row.extend([ne_text, ne_type, cnt])
-
-                    # Padding
-                    missing = top_n - len(c)
-                    if missing > 0:
-                        row.extend(["", "", 0] * missing)
-
-                    w.writerow(row)
-
-                count_processed += 1
+            w.writerows(pending_rows)
 
             print(f"[Stats] Processed {count_processed} documents.")
             print(f"[Stats] Saved to {stats_file}")
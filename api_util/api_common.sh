@@ -20,7 +20,7 @@ if [ ! -d "$INPUT_DIR" ]; then
 fi
 
 # Check for required Python scripts
-for script in manifest.py chunk.py analyze.py; do
+for script in manifest.py chunk.py analyze.py cnec_types.py; do
     if [ ! -f "$SCRIPT_DIR/$script" ]; then
         echo "Error: Helper script '$script' not found in $SCRIPT_DIR"
         exit 1
@@ -9,13 +9,24 @@
 
 import sys
 import os
+import re
+
+# Whitespace-separated words, the same tokens as str.split()
+WORD_RE = re.compile(r'\S+')
+
+# Words ending with these close a sentence, where a chunk may be cut
+SENTENCE_ENDINGS = ('.', '?', '!')
+
+WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB
 
 
 def write_chunk(output_dir, chunk_index, words_list):
     """Helper to write a list of words to a file."""
     filename = os.path.join(output_dir, f"chunk_{chunk_index}.txt")
-    with open(filename, 'w', encoding='utf-8') as out:
-        out.write(" ".join(words_list))
+    # Join and encode once, then hand the whole chunk over in one write
+    buf = " ".join(words_list).encode('utf-8')
+    with open(filename, 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+        out.write(buf)
 
 
 def main():
@@ -38,44 +49,44 @@ def main():
     if not text:
         sys.exit(0)
 
-    words = text.split()
     current_chunk = []
     chunk_count = 0
-
-    # Iterate through all words
-    i = 0
-    while i < len(words):
-        current_chunk.append(words[i])
-        i += 1
+    # Index of the last word in current_chunk ending a sentence, kept up to
+    # date as words are appended so a split needs no backwards scan
+    last_boundary = -1
+
+    # Iterate through all words, streamed from the text instead of
+    # materializing the full split() list up front
+    for match in WORD_RE.finditer(text):
+        word = match.group()
+        # Check if the word ends with standard sentence delimiters
+        if word.endswith(SENTENCE_ENDINGS):
+            last_boundary = len(current_chunk)
+        current_chunk.append(word)
 
         # Check if the current buffer has reached the word limit
         if len(current_chunk) >= limit:
-            cut_index = -1
-
-            # Scan backwards from the end of the current chunk to find punctuation.
+            # Cut immediately after the last punctuation word.
             # We limit the lookback (e.g., 100 words) to prevent losing too much context
             # if a sentence is extremely long.
             lookback_limit = max(0, len(current_chunk) - 100)
 
-            for j in range(len(current_chunk) - 1, lookback_limit, -1):
-                word = current_chunk[j]
-                # Check if the word ends with standard sentence delimiters
-                if word and word[-1] in ['.', '?', '!']:
-                    cut_index = j + 1  # Cut immediately after the punctuation word
-                    break
-
-            # Fallback: If no punctuation is found (e.g., a very long list),
-            # we are forced to split at the hard limit.
-            if cut_index == -1:
+            if last_boundary > lookback_limit:
+                cut_index = last_boundary + 1
+            else:
+                # Fallback: If no punctuation is found (e.g., a very long list),
+                # we are forced to split at the hard limit.
                 cut_index = len(current_chunk)
 
             # Write the valid sentence block to a file
             write_chunk(outdir, chunk_count, current_chunk[:cut_index])
             chunk_count += 1
 
-            # The remaining words (if we split early) become the start of the next chunk
+            # The remaining words (if we split early) become the start of the next chunk;
+            # they all come after the cut, so none of them ends a sentence yet
             leftovers = current_chunk[cut_index:]
             current_chunk = leftovers
+            last_boundary = -1
 
     # Write any remaining words in the buffer (the final chunk)
     if current_chunk:
@@ -0,0 +1,116 @@
+# api_util/cnec_types.py
+# CNEC 2.0 named entity types shared by the NameTag post-processing scripts.
+import functools
+
+# --- CNEC 2.0 Type Hierarchy Mapping ---
+# Based on: https://ufal.mff.cuni.cz/~strakova/cnec2.0/ne-type-hierarchy.pdf
+CNEC_TYPE_MAP = {
+    # a: Numbers, addresses, time
+    "a": "Address/Number/Time (General)",
+    "A": "Complex Address/Number/Time",
+    "ah": "Street address",
+    "at": "Phone/Fax number",
+    "az": "Zip code",
+
+    # g: Geographical names
+    "g": "Geographical name (General)",
+    "G": "Geographical name (General)",
+    "g_": "Geographical name (General)",
+    "gu": "Settlement name (City/Town)",
+    "gl": "Nature/Landscape name (Mountain/River)",
+    "gq": "Urban geographical name (Street/Square)",
+    "gr": "Territorial name (State/Region)",
+    "gs": "Super-terrestrial name (Star/Planet)",
+    "gc": "States/Provinces/Regions",
+    "gt": "Continents",
+    "gh": "Hydronym (Bodies of water)",
+
+    # i: Institutions
+    "i": "Institution name (General)",
+    "i_": "Institution name (General)",
+    "I": "Institution name (General)",
+    "ia": "Conference/Contest",
+    "if": "Company/Firm",
+    "io": "Organization/Society",
+    "ic": "Cult/Educational institution",
+
+    # m: Media names
+    "m": "Media name (General)",
+    "mn": "Periodical name (Newspaper/Magazine)",
+    "ms": "Radio/TV station",
+    "mi": "Internet links",
+
+    # o: Artifact names
+    "o": "Artifact name (General)",
+    "o_": "Artifact name (General)",
+    "oa": "Cultural artifact (Book/Painting)",
+    "oe": "Measure unit",
+    "om": "Currency",
+    "or": "Directives, norms",
+    "op": "Product (General)",
+
+    # p: Personal names
+    "p": "Personal name (General)",
+    "p_": "Personal name (General)",
+    "P": "Complex personal names",
+    "pf": "First name",
+    "ps": "Surname",
+    "pm": "Second name",
+    "ph": "Nickname/Pseudonym",
+    "pc": "Inhabitant name",
+    "pd": "Academic titles",
+    "pp": "Relig./myth persons",
+    "me": "Email address",
+
+    # t: Time expressions
+    "t": "Time expression (General)",
+    "T": "Complex time expressions",
+    "td": "Day",
+    "th": "Hour",
+    "tm": "Month",
+    "ty": "Year",
+    "tf": "Holiday/Feast",
+    "tt": "Time block",
+
+    # n: Number expressions
+    "n": "Number expression (General)",
+    "N": "Complex number expressions",
+    "n_": "Number expression (General)",
+    "na": "Age",
+    "nb": "Volu-metric number",
+    "nc": "Cardinal number",
+    "ni": "Itemizer (1.)",
+    "no": "Ordinal number",
+    "ns": "Sport score",
+
+    # General / Fallback
+    "unk": "Unknown Type",
+    "O": "None",
+    "C": "Complex bibliographic expression",
+}
+
+
+# Prefixes of tags that begin or continue an entity
+_BIO_PREFIXES = frozenset(("B-", "I-"))
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_tag_and_type(raw_tag):
+    """
+    Parses a raw BIO tag (e.g., "B-p", "I-p", "O").
+    Returns (BIO_Tag, Full_Type_Name).
+    The set of distinct tags is small, so results are memoized.
+    """
+    # Handle cases like "B-P|B-pf" by taking the first one
+    primary = raw_tag.partition('|')[0]
+
+    # Only B-type / I-type carry an entity; "O", "" and anything else do not
+    if primary[:2] not in _BIO_PREFIXES:
+        return "O", None
+
+    # Strip prefix to get the short code (e.g., "p" from "B-p")
+    short_code = primary[2:]
+    full_type_name = CNEC_TYPE_MAP.get(short_code)
+    if full_type_name is None:
+        full_type_name = f"Unknown Code ({short_code})"
+    return primary, full_type_name
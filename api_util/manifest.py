@@ -25,6 +25,55 @@ import sys
 import re
 
 
+# Regex: Matches "Name-123.txt" or "Name_123.txt"
+# Group 1: DocID, Group 2: PageNum
+PAGE_NAME_RE = re.compile(r'^(.*)[-_](\d+)\.txt$')
+
+
+def split_page_name(filename):
+    """
+    Splits "Name-123.txt" / "Name_123.txt" into ("Name", 123).
+    Returns None if the filename carries no page number.
+    """
+    # Fast path: the page number follows the last separator
+    stem = filename[:-4]
+    idx = max(stem.rfind('-'), stem.rfind('_'))
+    page = stem[idx + 1:]
+    if idx > 0 and page.isdecimal():
+        return stem[:idx], int(page)
+
+    # Fallback for unusual names (e.g. empty DocID)
+    match = PAGE_NAME_RE.match(filename)
+    if match:
+        return match.group(1), int(match.group(2))
+    return None
+
+
+def walk_txt(root):
+    """
+    Recursively yields DirEntry objects of all .txt files under root.
+    Like os.walk, lists a directory's files before descending into its
+    subdirectories, does not follow directory symlinks and skips
+    unreadable directories; DirEntry caches the file type, so no extra
+    stat() calls are needed.
+    """
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir():
+            if not entry.is_symlink():
+                subdirs.append(entry.path)
+        elif entry.name.endswith(".txt"):
+            yield entry
+
+    for path in subdirs:
+        yield from walk_txt(path)
+
+
 def main():
     if len(sys.argv) < 3:
         print("Usage: manifest.py <input_dir> <manifest_path>")
@@ -33,46 +82,37 @@ def main():
     input_dir = sys.argv[1]
     manifest_path = sys.argv[2]
 
-    doc_map = {}
-    # Regex: Matches "Name-123.txt" or "Name_123.txt"
-    # Group 1: DocID, Group 2: PageNum
-    pattern = re.compile(r'^(.*)[-_](\d+)\.txt$')
+    # Flat (DocID, PageNum, Path) records, sorted once after the scan
+    records = []
 
     count_processed = 0
     count_skipped = 0
 
     print(f"[Manifest] Scanning: {input_dir}")
 
-    for root, dirs, files in os.walk(input_dir):
-        for f in files:
-            if not f.endswith(".txt"):
-                continue
-
-            match = pattern.match(f)
-            if match:
-                doc_id = match.group(1)
-                page_num = int(match.group(2))
-                full_path = os.path.join(root, f)
-
-                if doc_id not in doc_map:
-                    doc_map[doc_id] = []
-                doc_map[doc_id].append((page_num, full_path))
-                count_processed += 1
-            else:
-                # Warn user about files that don't match the expected format
-                print(f"[Warn] Skipping file (no page number found): {f}", file=sys.stderr)
-                count_skipped += 1
+    for entry in walk_txt(input_dir):
+        f = entry.name
+        parsed = split_page_name(f)
+        if parsed:
+            doc_id, page_num = parsed
+            full_path = entry.path
+
+            records.append((doc_id, page_num, full_path))
+            count_processed += 1
+        else:
+            # Warn user about files that don't match the expected format
+            print(f"[Warn] Skipping file (no page number found): {f}", file=sys.stderr)
+            count_skipped += 1
 
     # Ensure output directory exists
     os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
 
+    # Sort by DocID (alphabetical), then by PageNum (numerical); the sort is
+    # stable, so duplicate pages keep their scan order
+    records.sort(key=lambda r: (r[0], r[1]))
+
     with open(manifest_path, 'w', encoding='utf-8') as out:
-        # Sort by DocID (alphabetical), then by PageNum (numerical)
-        for doc_id in sorted(doc_map.keys()):
-            # Sort the tuples by the first element (page_num)
-            pages = sorted(doc_map[doc_id], key=lambda x: x[0])
-            for pg, path in pages:
-                out.write(f"{doc_id}\t{pg}\t{path}\n")
+        out.write("".join(f"{doc_id}\t{pg}\t{path}\n" for doc_id, pg, path in records))
 
     print(f"[Manifest] Done. Mapped {count_processed} files. Skipped {count_skipped}.")
     print(f"[Manifest] Saved to: {manifest_path}")
@@ -1,14 +1,31 @@
-import json
+import functools
+import re
 import sys
 import os
-from collections import defaultdict
 
+# orjson parses large NameTag responses several times faster when it is
+# installed; both loads() accept the raw bytes of the file
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
+# The original CoNLL-U is read line by line; a large buffer keeps that
+# to a few read() calls even for multi-MB documents
+READ_BUFFER_SIZE = 1 << 20  # 1 MiB
+
+# Word and Tag of a NameTag "conll" line ([Word] [TAB] [Tag] ...); comment
+# lines and lines without a tab do not match
+TOKEN_LINE_RE = re.compile(r'^(?!#)([^\t\n]*)\t([^\t\n]*)', re.M)
+
+
+@functools.lru_cache(maxsize=1024)
 def get_ne_suffix(tag_string):
     """
     Extracts the entity suffix (type) from a BIO tag.
     Handles single tags (e.g., "B-per") and multi-tags (e.g., "B-C|B-ic").
     If the tag is "O", it returns "O".
+    Called once per token over a small set of distinct tags, so memoized.
     """
     if not tag_string:
         return ""
@@ -34,6 +51,26 @@ def get_ne_suffix(tag_string):
     return '|'.join(suffixes)
 
 
+def iter_sentence_blocks(text):
+    """
+    Yields the non-blank sentence blocks of a NameTag result, i.e. the
+    parts of the stripped text between empty lines, in order. Walks the
+    text by index instead of building the whole list of blocks up front.
+    """
+    text = text.strip()
+    pos = 0
+    end_of_text = len(text)
+
+    while pos <= end_of_text:
+        end = text.find('\n\n', pos)
+        if end < 0:
+            end = end_of_text
+        block = text[pos:end]
+        if block.strip():
+            yield block
+        pos = end + 2
+
+
 def parse_nametag_response():
     if len(sys.argv) < 5:
         print("Usage: python3 nametag.py <orig_conllu> <json_resp> <out_dir> <basename>", file=sys.stderr)
@@ -51,7 +88,7 @@ def parse_nametag_response():
     current_page = 0
 
     try:
-        with open(orig_file, 'r', encoding='utf-8') as f:
+        with open(orig_file, 'r', encoding='utf-8', buffering=READ_BUFFER_SIZE) as f:
             for line in f:
                 line = line.strip()
                 if not line: continue
@@ -80,51 +117,39 @@ def parse_nametag_response():
         sys.exit(1)
 
     # --- PART B: Parse NameTag Result ---
-    # Store simply as list of (word, tag) tuples per page
-    tokens_by_page = defaultdict(list)
+    # The output rows of each page are encoded straight into its buffer
+    page_buffers = {}
 
     try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_file, 'rb') as f:
+            data = json_loads(f.read())
 
         tagged_content = data.get('result', '')
         # Split by empty lines to get sentences
-        sentences = [s for s in tagged_content.strip().split('\n\n') if s.strip()]
-
-        for idx, sent_block in enumerate(sentences):
+        for idx, sent_block in enumerate(iter_sentence_blocks(tagged_content)):
             # Match this sentence to its page number
             page_num = sent_to_page[idx] if idx < len(sent_to_page) else current_page
 
-            lines = sent_block.split('\n')
-
-            for line in lines:
-                if line.startswith('#'): continue
-
-                parts = line.split('\t')
+            # One C-level regex pass picks (Word, Tag) from every token line
+            # of the sentence, without splitting it into lines and columns
+            rows = [f"{word}\t{tag}\t{get_ne_suffix(tag)}\n"
+                    for word, tag in TOKEN_LINE_RE.findall(sent_block)]
 
-                # NameTag "conll" output is: [Word] [TAB] [Tag]
-                if len(parts) < 2:
-                    continue
-
-                word = parts[0]  # Column 0 is the Word
-                tag = parts[1]  # Column 1 is the Tag (B-per, O, etc.)
-
-                # We save every word and its tag directly
-                tokens_by_page[page_num].append((word, tag))
+            # One encode per sentence; pages without tokens get no buffer
+            if rows:
+                buf = page_buffers.get(page_num)
+                if buf is None:
+                    buf = page_buffers[page_num] = bytearray()
+                buf += "".join(rows).encode('utf-8')
 
         # --- PART C: Write Output Files ---
-        for page_num, token_list in tokens_by_page.items():
+        for page_num, buf in page_buffers.items():
             out_filename = f"{file_base}-{page_num}.tsv"
             out_path = os.path.join(output_dir, out_filename)
 
-            with open(out_path, 'w', encoding='utf-8') as f_out:
-                # Header for 3 columns
-                f_out.write("Word\tTag\tNE\n")
-
-                for word, tag in token_list:
-                    # Calculate the NE column (suffix)
-                    ne_val = get_ne_suffix(tag)
-                    f_out.write(f"{word}\t{tag}\t{ne_val}\n")
+            with open(out_path, 'wb') as f_out:
+                # Header for 3 columns, then the page rows in a single write
+                f_out.write(b"Word\tTag\tNE\n" + buf)
 
     except Exception as e:
         sys.stderr.write(f"Error parsing JSON/CoNLL: {e}\n")
@@ -1,14 +1,33 @@
 import sys
 import os
 import argparse
+import functools
+import itertools
 from pathlib import Path
 import csv
 import re
 import glob
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Increase CSV field size limit just in case
 csv.field_size_limit(sys.maxsize)
 
+# Page number suffix of per-page NameTag files, e.g. "docname-1.tsv"
+_PAGE_RE = re.compile(r'-(\d+)\.tsv$')
+
+# Write buffer of the per-page CSVs, so a page is written in one go
+WRITE_BUFFER_SIZE = 1 << 20  # 1 MiB
+
+# Leading columns of every per-page CSV, followed by the udpipe.* columns
+PAGE_CSV_COLUMNS = ('page_id', 'token', 'lemma', 'position', 'nameTag')
+
+# Characters not allowed in output filenames, each mapped to '_'
+_SANITIZE_TABLE = str.maketrans({c: '_' for c in '\\/*?:"<>|'})
+
+# "Key=Value" items of a FEATS/MISC column ("Case=Nom|Gender=Fem"); the value
+# keeps any further '=' like split('=', 1), items without '=' do not match
+KV_RE = re.compile(r'([^|=]*)=([^|]*)')
+
 
 def load_config(config_path="api_config.env"):
     if not os.path.exists(config_path):
@@ -25,123 +44,197 @@ def load_config(config_path="api_config.env"):
                 os.environ[key] = value
 
 
+def count_ext(dirpath, ext):
+    """Counts the entries of a directory ending in ext, with no stat() per entry."""
+    return sum(1 for e in os.scandir(dirpath) if e.name.endswith(ext))
+
+
+@functools.lru_cache(maxsize=4096)
 def sanitize_filename(name):
-    return re.sub(r'[\\/*?:"<>|]', '_', name)
+    return name.translate(_SANITIZE_TABLE)
 
 
 def get_sorted_tsv_content(doc_tsv_dir):
     """
     Reads all .tsv files in the document directory, sorts them by page number
-    (assuming format doc-PAGE.tsv), and returns a single list of tokens/tags.
+    (assuming format doc-PAGE.tsv), and returns the list of tags covering
+    the whole document.
     """
-    all_data = []
+    tags = []
 
-    files = list(Path(doc_tsv_dir).glob("*.tsv"))
+    files = [e for e in os.scandir(doc_tsv_dir) if e.name.endswith(".tsv")]
 
-    def sort_key(filepath):
-        try:
-            match = re.search(r'-(\d+)\.tsv$', filepath.name)
-            if match:
-                return int(match.group(1))
-            return 0
-        except:
-            return 0
+    def sort_key(entry):
+        match = _PAGE_RE.search(entry.name)
+        return int(match.group(1)) if match else 0
 
     files.sort(key=sort_key)
 
     for fpath in files:
         with open(fpath, 'r', encoding='utf-8') as f:
-            header = next(f, None)
-            for line in f:
-                line = line.strip()
-                if not line: continue
-
-                parts = line.split('\t')
-                if len(parts) >= 2:
-                    all_data.append({'token': parts[0], 'tag': parts[1]})
-                else:
-                    all_data.append({'token': parts[0], 'tag': 'O'})
+            # One bulk read; the first line is the header
+            lines = f.read().split('\n')[1:]
+
+        for line in lines:
+            line = line.strip()
+            if not line: continue
+
+            _, sep, rest = line.partition('\t')
+            tags.append(rest.partition('\t')[0] if sep else 'O')
+
+    return tags
 
-    return all_data
 
+@functools.lru_cache(maxsize=1024)
+def ner_attr(tag):
+    """Formats the MISC attribute of a NER tag, once per distinct tag."""
+    return f"NER={tag}"
 
-def merge_and_write(conllu_path, tsv_data, output_path):
+
+def iter_merged(conllu_path, tags):
+    """
+    Yields the lines of a CoNLL-U document (without line endings), with the
+    NER tag of each token from tags appended to its MISC column.
+    Yields nothing if the document cannot be read.
+    """
     tsv_index = 0
-    tsv_len = len(tsv_data)
+    tsv_len = len(tags)
 
     try:
-        with open(conllu_path, 'r', encoding='utf-8') as f_conllu, \
-                open(output_path, 'w', encoding='utf-8') as f_out:
-
-            for line in f_conllu:
-                stripped_line = line.strip()
-
-                if not stripped_line or stripped_line.startswith('#'):
-                    f_out.write(line)
-                    continue
-
-                cols = stripped_line.split('\t')
-
-                if len(cols) >= 2 and '-' not in cols[0] and '.' not in cols[0]:
-                    if tsv_index < tsv_len:
-                        tsv_item = tsv_data[tsv_index]
-                        new_attr = f"NER={tsv_item['tag']}"
-
-                        if len(cols) > 9:
-                            if cols[9] == '_':
-                                cols[9] = new_attr
-                            else:
-                                cols[9] += f"|{new_attr}"
-                        else:
-                            while len(cols) < 9:
-                                cols.append('_')
-                            cols.append(new_attr)
-
-                        f_out.write('\t'.join(cols) + '\n')
-                        tsv_index += 1
-                    else:
-                        f_out.write(line)
+        # Read the whole document at once; text mode keeps the universal
+        # newline handling of line-by-line reading
+        with open(conllu_path, 'r', encoding='utf-8') as f_conllu:
+            lines = f_conllu.read().split('\n')
+    except (OSError, ValueError) as e:
+        print(f"Error merging {conllu_path}: {e}", file=sys.stderr)
+        return
+
+    # Tags are a small closed set; map() over the cached formatter builds
+    # every "NER=<tag>" attribute up front, sharing one string per tag
+    ner_attrs = list(map(ner_attr, tags))
+
+    for line in lines:
+        # Fast path: blank and comment lines pass through untouched
+        if not line or line[0] == '#':
+            yield line
+            continue
+
+        stripped_line = line.strip()
+
+        if not stripped_line or stripped_line.startswith('#'):
+            yield line
+            continue
+
+        tab_count = stripped_line.count('\t')
+        id_col = stripped_line[:stripped_line.find('\t')]
+
+        # Plain word IDs are all digits, so one C-level isdigit() settles the
+        # common case; only other IDs need the multiword/empty-node scans
+        is_word = id_col.isdigit() or ('-' not in id_col and '.' not in id_col)
+
+        if tab_count and is_word and tsv_index < tsv_len:
+            new_attr = ner_attrs[tsv_index]
+            tsv_index += 1
+
+            if tab_count == 9:
+                # Regular 10-column line: MISC is the last column, so the
+                # tag is spliced onto the end without a split/join round-trip
+                if stripped_line.endswith('\t_'):
+                    yield stripped_line[:-1] + new_attr
                 else:
-                    f_out.write(line)
+                    yield f"{stripped_line}|{new_attr}"
+                continue
 
-        return True
+            cols = stripped_line.split('\t')
+            if len(cols) > 9:
+                if cols[9] == '_':
+                    cols[9] = new_attr
+                else:
+                    cols[9] += f"|{new_attr}"
+            else:
+                while len(cols) < 9:
+                    cols.append('_')
+                cols.append(new_attr)
 
-    except Exception as e:
-        print(f"Error merging {conllu_path}: {e}", file=sys.stderr)
-        return False
+            yield '\t'.join(cols)
+        else:
+            yield line
 
 
+def write_merged(merged_lines, output_path):
+    """
+    Passes merged CoNLL-U lines through unchanged while also saving them
+    to output_path, for runs that want to keep the merged document.
+    """
+    with open(output_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f_out:
+        for i, line in enumerate(merged_lines):
+            # Lines come without endings; rejoin them as they were split
+            if i:
+                f_out.write('\n')
+            f_out.write(line)
+            yield line
+
+
+# FEATS / MISC strings repeat heavily across tokens, so both parsers are
+# memoized; the returned dicts are shared and must not be modified. Their
+# keys come from a small closed set and are interned, so the per-page key
+# sets and the lookups in write_page_csv compare them by identity.
+@functools.lru_cache(maxsize=65536)
 def parse_features(feat_str):
     if feat_str == '_' or not feat_str: return {}
-    return {k: v for item in feat_str.split('|') if '=' in item for k, v in [item.split('=', 1)]}
+    return {sys.intern(k): v for k, v in KV_RE.findall(feat_str)}
 
 
+@functools.lru_cache(maxsize=65536)
 def parse_misc(misc_str):
     if misc_str == '_' or not misc_str: return {}
+    pairs = KV_RE.findall(misc_str)
+    # One match per item means there are no bare keys to fill in
+    if len(pairs) == misc_str.count('|') + 1:
+        return {sys.intern(k): v for k, v in pairs}
     misc = {}
     for item in misc_str.split('|'):
         if '=' in item:
             k, v = item.split('=', 1)
-            misc[k] = v
+            misc[sys.intern(k)] = v
         else:
-            misc[item] = "Yes"
+            misc[sys.intern(item)] = "Yes"
     return misc
 
 
-def write_page_csv(rows, output_dir, page_id, file_counter):
+@functools.lru_cache(maxsize=512)
+def page_csv_columns(feature_keys, misc_keys):
+    """
+    Returns (header, build_row) of a page CSV for the given frozensets of
+    FEATS / MISC keys. build_row(fixed, feats, misc) is generated for this
+    key set with every column lookup spelled out, so rows are built without
+    looping over the keys. Pages of a document mostly share the same keys,
+    so both are built once per distinct key set.
+    """
+    feature_keys = sorted(feature_keys)
+    misc_keys = sorted(misc_keys)
+    header = PAGE_CSV_COLUMNS + \
+        tuple(f'udpipe.feats.{k}' for k in feature_keys) + \
+        tuple(f'udpipe.misc.{k}' for k in misc_keys)
+
+    # Keys are embedded via repr(), so any key text is a plain string literal
+    lookups = [f"feats.get({k!r}, '')" for k in feature_keys] + \
+              [f"misc.get({k!r}, '')" for k in misc_keys]
+    source = ("def build_row(fixed, feats, misc):\n"
+              f"    return fixed + [{', '.join(lookups)}]\n")
+    namespace = {}
+    exec(source, namespace)
+    return header, namespace['build_row']
+
+
+def write_page_csv(rows, output_dir, page_id, file_counter, feature_keys, misc_keys):
+    # rows: (fixed, feats, misc) - the fixed column values in PAGE_CSV_COLUMNS
+    # order and the parsed FEATS / MISC dicts; feature_keys / misc_keys: the
+    # keys used by the rows, collected while they were built
     if not rows: return
 
-    feature_keys = set()
-    misc_keys = set()
-    for r in rows:
-        for k in r.keys():
-            if k.startswith('udpipe.feats.'):
-                feature_keys.add(k)
-            elif k.startswith('udpipe.misc.'):
-                misc_keys.add(k)
-
-    header = ['page_id', 'token', 'lemma', 'position', 'nameTag'] + \
-             sorted(list(feature_keys)) + sorted(list(misc_keys))
+    # NER already has its own nameTag column
+    header, build_row = page_csv_columns(frozenset(feature_keys), frozenset(misc_keys - {'NER'}))
 
     doc_name = os.path.basename(output_dir)
     safe_id = sanitize_filename(str(page_id))
@@ -150,122 +243,134 @@ def write_page_csv(rows, output_dir, page_id, file_counter):
     out_path = os.path.join(output_dir, filename)
 
     try:
-        with open(out_path, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=header)
-            writer.writeheader()
-            writer.writerows(rows)
+        with open(out_path, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE) as f:
+            # Plain writer: the fixed columns are already in order, the
+            # udpipe.* columns come from the generated row builder
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(itertools.starmap(build_row, rows))
     except Exception as e:
         print(f"  [Error] writing {filename}: {e}", file=sys.stderr)
 
 
-def process_merged_file_into_pages(merged_filepath, output_subdir):
+def process_merged_file_into_pages(merged_lines, output_subdir):
+    """Splits merged CoNLL-U lines into pages and writes one CSV per page."""
     current_rows = []
+    # FEATS / MISC keys of the current page, gathered as its rows are built
+    page_feat_keys = set()
+    page_misc_keys = set()
     page_counter = 0
 
-    with open(merged_filepath, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
+    for line in merged_lines:
+        line = line.strip()
+
+        if line.startswith('# sent_id'):
+            parts = line.split('=', 1)
+            if len(parts) > 1 and parts[1].strip() == '1':
+                if current_rows:
+                    write_page_csv(current_rows, output_subdir, page_counter, page_counter,
+                                   page_feat_keys, page_misc_keys)
+                    current_rows = []
+                    page_feat_keys = set()
+                    page_misc_keys = set()
+                page_counter += 1
+
+        if line.startswith('#') or not line:
+            continue
 
-            if line.startswith('# sent_id'):
-                parts = line.split('=', 1)
-                if len(parts) > 1 and parts[1].strip() == '1':
-                    if current_rows:
-                        write_page_csv(current_rows, output_subdir, page_counter, page_counter)
-                        current_rows = []
-                    page_counter += 1
+        parts = line.split('\t')
+        if len(parts) < 10 or '-' in parts[0]:
+            continue
 
-            if line.startswith('#') or not line:
-                continue
+        if page_counter == 0: page_counter = 1
 
-            parts = line.split('\t')
-            if len(parts) < 10 or '-' in parts[0]:
-                continue
+        misc = parse_misc(parts[9])
+        feats = parse_features(parts[5])
 
-            if page_counter == 0: page_counter = 1
+        # Fixed columns in PAGE_CSV_COLUMNS order; the parsed dicts are kept
+        # as they are and only prefixed once per page, in the header
+        fixed = [page_counter, parts[1], parts[2], parts[0], misc.get('NER', '')]
+        page_feat_keys.update(feats)
+        page_misc_keys.update(misc)
 
-            misc = parse_misc(parts[9])
-            feats = parse_features(parts[5])
+        current_rows.append((fixed, feats, misc))
 
-            row = {
-                'page_id': page_counter,
-                'token': parts[1],
-                'lemma': parts[2],
-                'position': parts[0],
-                'nameTag': misc.get('NER', ''),
-            }
-            for k, v in feats.items(): row[f'udpipe.feats.{k}'] = v
-            for k, v in misc.items():
-                if k != 'NER': row[f'udpipe.misc.{k}'] = v
+    if current_rows:
+        write_page_csv(current_rows, output_subdir, page_counter, page_counter,
+                       page_feat_keys, page_misc_keys)
 
-            current_rows.append(row)
 
-    if current_rows:
-        write_page_csv(current_rows, output_subdir, page_counter, page_counter)
+def process_document(conllu_file, tsv_root_obj, output_root_obj, keep_merged=False):
+    """
+    Merges one CoNLL-U document with its NameTag TSVs into per-page CSVs.
+    With keep_merged, the merged CoNLL-U is also saved next to the CSVs.
+    """
+    doc_name = conllu_file.stem
 
+    # 1. Define paths
+    doc_out_dir = output_root_obj / doc_name
+    doc_tsv_dir = tsv_root_obj / doc_name
 
-def process_pipeline(conllu_dir, tsv_root, output_root):
-    conllu_path_obj = Path(conllu_dir)
-    tsv_root_obj = Path(tsv_root)
-    output_root_obj = Path(output_root)
+    if not doc_tsv_dir.exists() or not doc_tsv_dir.is_dir():
+        print(f"[Skip] No TSV directory found for: {doc_name} (checked {doc_tsv_dir})")
+        return
 
-    if not conllu_path_obj.exists():
-        print(f"Error: CoNLL-U dir not found: {conllu_dir}")
-        sys.exit(1)
+    # 2. Count Input vs Output to determine skip
+    # We need to know how many pages exist in the input to compare with output
+    count_input = count_ext(doc_tsv_dir, ".tsv")
 
-    conllu_files = sorted(list(conllu_path_obj.glob('*.conllu')))
-    print(f"Found {len(conllu_files)} documents to process.")
+    if doc_out_dir.exists():
+        count_output = count_ext(doc_out_dir, ".csv")
 
-    output_root_obj.mkdir(parents=True, exist_ok=True)
+        # --- STRICT SKIP LOGIC ---
+        # Only skip if the output count exactly matches input count
+        if count_input > 0 and count_input == count_output:
+            print(f"[Skip] {doc_name}: Output complete ({count_output} CSVs match {count_input} TSVs).")
+            return
+        elif count_output > 0:
+            print(f"[Reprocess] {doc_name}: Count mismatch (Input: {count_input} vs Output: {count_output}).")
 
-    for conllu_file in conllu_files:
-        doc_name = conllu_file.stem
+    print(f"[Processing] {doc_name}...")
 
-        # 1. Define paths
-        doc_out_dir = output_root_obj / doc_name
-        doc_tsv_dir = tsv_root_obj / doc_name
+    # 3. Gather all pages (TSVs) into one stream
+    tags = get_sorted_tsv_content(doc_tsv_dir)
+    if not tags:
+        print(f"  [Warn] No valid TSV data found in {doc_tsv_dir}")
+        return
 
-        if not doc_tsv_dir.exists() or not doc_tsv_dir.is_dir():
-            print(f"[Skip] No TSV directory found for: {doc_name} (checked {doc_tsv_dir})")
-            continue
+    # 4. Create output folder
+    doc_out_dir.mkdir(exist_ok=True)
 
-        # 2. Count Input vs Output to determine skip
-        # We need to know how many pages exist in the input to compare with output
-        input_tsvs = list(doc_tsv_dir.glob("*.tsv"))
-        count_input = len(input_tsvs)
+    # 5. Merge and generate CSVs in one pass, without a temp file
+    merged_lines = iter_merged(conllu_file, tags)
+    if keep_merged:
+        merged_lines = write_merged(merged_lines, doc_out_dir / f"{doc_name}_merged.conllu")
+    process_merged_file_into_pages(merged_lines, doc_out_dir)
 
-        if doc_out_dir.exists():
-            output_csvs = list(doc_out_dir.glob("*.csv"))
-            count_output = len(output_csvs)
 
-            # --- STRICT SKIP LOGIC ---
-            # Only skip if the output count exactly matches input count
-            if count_input > 0 and count_input == count_output:
-                print(f"[Skip] {doc_name}: Output complete ({count_output} CSVs match {count_input} TSVs).")
-                continue
-            elif count_output > 0:
-                print(f"[Reprocess] {doc_name}: Count mismatch (Input: {count_input} vs Output: {count_output}).")
+def process_pipeline(conllu_dir, tsv_root, output_root, keep_merged=False):
+    conllu_path_obj = Path(conllu_dir)
+    tsv_root_obj = Path(tsv_root)
+    output_root_obj = Path(output_root)
 
-        print(f"[Processing] {doc_name}...")
+    if not conllu_path_obj.exists():
+        print(f"Error: CoNLL-U dir not found: {conllu_dir}")
+        sys.exit(1)
 
-        # 3. Gather all pages (TSVs) into one stream
-        tsv_data = get_sorted_tsv_content(doc_tsv_dir)
-        if not tsv_data:
-            print(f"  [Warn] No valid TSV data found in {doc_tsv_dir}")
-            continue
+    conllu_files = sorted(list(conllu_path_obj.glob('*.conllu')))
+    print(f"Found {len(conllu_files)} documents to process.")
 
-        # 4. Create output folder
-        doc_out_dir.mkdir(exist_ok=True)
+    output_root_obj.mkdir(parents=True, exist_ok=True)
 
-        # 5. Merge
-        merged_file_path = doc_out_dir / f"{doc_name}_merged.tmp"
-        if merge_and_write(conllu_file, tsv_data, merged_file_path):
-            # 6. Generate CSVs
-            process_merged_file_into_pages(merged_file_path, doc_out_dir)
-            # Cleanup temp file
-            try:
-                os.remove(merged_file_path)
-            except:
-                pass
+    # Documents are independent, so they are processed on all cores;
+    # no more workers are started than there are documents
+    n_workers = max(1, min(os.cpu_count() or 1, len(conllu_files)))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(process_document, conllu_file, tsv_root_obj, output_root_obj, keep_merged)
+                   for conllu_file in conllu_files]
+        for future in as_completed(futures):
+            # Re-raise any error from the worker
+            future.result()
 
     print("\nPipeline Complete.")
 
@@ -276,13 +381,15 @@ def main():
     parser.add_argument('--conllu-dir', default=os.getenv('CONLLU_INPUT_DIR'))
     parser.add_argument('--tsv-dir', default=os.getenv('TSV_INPUT_DIR'))
     parser.add_argument('--out-dir', default=os.getenv('SUMMARY_OUTPUT_DIR'))
+    parser.add_argument('--keep-merged', action='store_true',
+                        help="Also save each merged CoNLL-U as <doc>_merged.conllu in its output folder")
     args = parser.parse_args()
 
     if not all([args.conllu_dir, args.tsv_dir, args.out_dir]):
         print("Missing arguments. Check config or flags.")
         sys.exit(1)
 
-    process_pipeline(args.conllu_dir, args.tsv_dir, args.out_dir)
+    process_pipeline(args.conllu_dir, args.tsv_dir, args.out_dir, args.keep_merged)
 
 
 if __name__ == "__main__":